@@ -1,19 +1,70 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, StreamingResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ConfigDict, Field, NonNegativeInt, PositiveInt, field_validator
 import os
+import asyncio
+import functools
+import itertools
 import logging
-from services.downloader import get_video_url, get_video_info
-from services.processor import process_video, split_video, stream_video_segment
 import math
+import mimetypes
+from services.downloader import get_video_url, get_video_info_async, EXTRACTOR_POOL
+from services.processor import process_video, split_video, stream_video_segment, start_hls_session, stop_hls_session, hls_playlist_ready, HLS_ROOT, RENDITION_HEIGHTS, FFmpegBusyError, FFMPEG_JOB_POOL
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class MediaAwareGZipMiddleware:
+    """
+    Gzips JSON/HTML responses only. MP4 and ZIP bodies are already compressed,
+    so they bypass GZipMiddleware and go straight to the client.
+    """
+    SKIP_CONTENT_TYPES = ("video/", "application/zip")
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def route(scope, receive, gzip_send):
+            passthrough = False
+
+            async def send_message(message):
+                nonlocal passthrough
+                if message["type"] == "http.response.start":
+                    content_type = Headers(raw=message["headers"]).get("content-type", "")
+                    passthrough = content_type.startswith(self.SKIP_CONTENT_TYPES)
+                await (send if passthrough else gzip_send)(message)
+
+            await self.app(scope, receive, send_message)
+
+        await GZipMiddleware(route, minimum_size=self.minimum_size)(scope, receive, send)
+
+# Starlette streams files in 64KB chunks by default; use 1MB reads for large MP4/ZIP downloads
+FileResponse.chunk_size = 1 << 20
+
 app = FastAPI(title="Facebook Video Downloader & Cutter")
 
+async def run_extractor(func, *args):
+    """Runs a blocking extractor call in EXTRACTOR_POOL and awaits the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXTRACTOR_POOL, func, *args)
+
+async def run_ffmpeg_job(func, *args, **kwargs):
+    """Runs a blocking ffmpeg job in FFMPEG_JOB_POOL and awaits the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(FFMPEG_JOB_POOL, functools.partial(func, *args, **kwargs))
+
 # Enable CORS for local testing
 app.add_middleware(
     CORSMiddleware,
@@ -22,27 +73,125 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MediaAwareGZipMiddleware, minimum_size=1024)
+
+# HLS playlists and fMP4 segments written by start_hls_session
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+app.mount("/hls", StaticFiles(directory=HLS_ROOT), name="hls")
 
-class VideoRequest(BaseModel):
+# How long /stream-hls waits for the first segment before giving up
+HLS_READY_TIMEOUT = 20
+# How long a segment stream waits for a free ffmpeg slot before answering 503,
+# and the Retry-After sent with it
+SLOT_WAIT_TIMEOUT = 30
+BUSY_RETRY_AFTER = 5
+
+class APIModel(BaseModel):
+    # Unknown fields are dropped and pasted URLs lose stray whitespace
+    model_config = ConfigDict(extra='ignore', str_strip_whitespace=True)
+
+class VideoRequest(APIModel):
     url: str
-    start_time: int
-    end_time: int
+    start_time: NonNegativeInt
+    end_time: NonNegativeInt
 
-class AnalyzeRequest(BaseModel):
+class AnalyzeRequest(APIModel):
     url: str
-    chunk_duration: int
+    chunk_duration: NonNegativeInt # 0 = whole video as one segment
     platform: str = "fb" # Optional, for future use
 
-class ProcessSegmentRequest(BaseModel):
+class ProcessSegmentRequest(APIModel):
     url: str
-    start: int
-    end: int
+    start: NonNegativeInt
+    end: NonNegativeInt
     segment_index: int | str
     format_id: str | None = None
+    proxy: bool = False
 
-class ProcessRequest(BaseModel):
+class ProcessRequest(APIModel):
     url: str
-    chunk_duration: int
+    chunk_duration: PositiveInt
+    precise: bool = False # re-encode for exact chunk boundaries instead of keyframe cuts
+    renditions: list[int] | None = Field(None, max_length=len(RENDITION_HEIGHTS)) # extra heights, e.g. [720, 480], encoded from one decode
+
+    @field_validator('renditions')
+    @classmethod
+    def check_renditions(cls, heights):
+        """Each height must be on the RENDITION_HEIGHTS ladder; duplicates are dropped."""
+        if heights is None:
+            return None
+        unsupported = sorted(set(heights) - set(RENDITION_HEIGHTS))
+        if unsupported:
+            raise ValueError(f"Unsupported rendition heights {unsupported}; choose from {list(RENDITION_HEIGHTS)}")
+        return list(dict.fromkeys(heights))
+
+# int | float: whole-second boundaries keep serializing as 60, not 60.0
+class Segment(BaseModel):
+    id: int
+    start: int | float
+    end: int | float
+    filename: str
+
+# Declared response models let pydantic serialize /analyze (dozens of format
+# dicts) straight to JSON bytes instead of going through jsonable_encoder
+class AnalyzeResponse(BaseModel):
+    title: str | None
+    total_duration: int | float
+    segments: list[Segment]
+    formats: list[dict]
+
+def full_video_redirect(info: dict, direct_url: str, start: int, end: int):
+    """
+    Returns a redirect straight to the CDN when the request is the whole,
+    already-muxed video, so the bytes don't have to pass through us.
+    YouTube URLs are bound to the server's IP, so those are always proxied.
+    """
+    duration = info.get('duration') or 0
+    # The frontend sends whole seconds (Math.floor of the duration), so a
+    # fractional duration counts as fully covered by its floor
+    if duration <= 0 or start != 0 or end < math.floor(duration) or info.get('audio_url'):
+        return None
+    if 'googlevideo.com' in direct_url or 'youtube.com' in direct_url:
+        return None
+    logger.info("Full video requested, redirecting to source URL")
+    return RedirectResponse(direct_url, status_code=302)
+
+def segment_headers(filename: str) -> dict:
+    """
+    Response headers for a transcoded segment stream. Its bytes only exist
+    while ffmpeg produces them, so byte ranges can't be served; saying so
+    makes download managers restart cleanly instead of appending a resume.
+    """
+    return {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "none",
+    }
+
+async def segment_response(start_stream, filename: str) -> StreamingResponse:
+    """
+    Streams the generator returned by `start_stream()` (a stream_video_segment
+    call). Its first chunk is read before answering, so a failed start becomes
+    an error status instead of a 200 with an empty body. While every ffmpeg
+    slot is busy it retries for up to SLOT_WAIT_TIMEOUT seconds, without
+    holding a thread, then raises FFmpegBusyError.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SLOT_WAIT_TIMEOUT
+    while True:
+        chunks = start_stream()
+        try:
+            first = await run_in_threadpool(next, chunks, b'')
+            break
+        except FFmpegBusyError:
+            if loop.time() > deadline:
+                raise
+            await asyncio.sleep(1)
+    return StreamingResponse(
+        itertools.chain([first], chunks),
+        media_type="video/mp4",
+        headers=segment_headers(filename)
+    )
 
 def cleanup_file(path: str):
     """Background task to remove the file after it's sent."""
@@ -58,11 +207,12 @@ async def process_video_endpoint(request: VideoRequest, background_tasks: Backgr
     try:
         # 1. Get direct URL
         logger.info(f"Received request for URL: {request.url}")
-        direct_url = get_video_url(request.url)
+        direct_url = await run_extractor(get_video_url, request.url)
         logger.info(f"Extracted Direct URL: {direct_url}")
         
         # 2. Process video (Download & Cut)
-        output_path = process_video(direct_url, request.start_time, request.end_time)
+        # Blocking (it may also wait for an ffmpeg slot), so off the event loop
+        output_path = await run_ffmpeg_job(process_video, direct_url, request.start_time, request.end_time)
         
         # 3. Return file and schedule cleanup
         filename = os.path.basename(output_path)
@@ -73,7 +223,8 @@ async def process_video_endpoint(request: VideoRequest, background_tasks: Backgr
         return FileResponse(
             path=output_path, 
             filename=filename, 
-            media_type="video/mp4"
+            media_type="video/mp4",
+            stat_result=os.stat(output_path)
         )
 
     except ValueError as e:
@@ -82,11 +233,11 @@ async def process_video_endpoint(request: VideoRequest, background_tasks: Backgr
         logger.error(f"Internal server error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/analyze")
+@app.post("/analyze", response_model=AnalyzeResponse)
 async def analyze_video_endpoint(request: AnalyzeRequest):
     try:
         # Get metadata only
-        info = get_video_info(request.url)
+        info = await get_video_info_async(request.url)
         duration = info['duration']
         title = info['title']
         
@@ -95,7 +246,6 @@ async def analyze_video_endpoint(request: AnalyzeRequest):
             
         if request.chunk_duration == 0:
             # Full video download mode
-            num_segments = 1
             segments = [{
                 "id": 1,
                 "start": 0,
@@ -103,17 +253,22 @@ async def analyze_video_endpoint(request: AnalyzeRequest):
                 "filename": "full_video.mp4"
             }]
         else:
-            num_segments = math.ceil(duration / request.chunk_duration)
-            segments = []
-            
-            for i in range(num_segments):
-                start = i * request.chunk_duration
-                end = min((i + 1) * request.chunk_duration, duration)
+            # Full-length chunks, then the remainder (if any) as a shorter last part
+            cd = request.chunk_duration
+            full_chunks = int(duration // cd)
+            segments = [{
+                "id": i + 1,
+                "start": i * cd,
+                "end": (i + 1) * cd,
+                "filename": f"part_{i+1}.mp4"
+            } for i in range(full_chunks)]
+
+            if duration - full_chunks * cd > 0:
                 segments.append({
-                    "id": i + 1,
-                    "start": start,
-                    "end": end,
-                    "filename": f"part_{i+1}.mp4"
+                    "id": full_chunks + 1,
+                    "start": full_chunks * cd,
+                    "end": duration,
+                    "filename": f"part_{full_chunks+1}.mp4"
                 })
             
         return {
@@ -131,70 +286,130 @@ async def analyze_video_endpoint(request: AnalyzeRequest):
 async def process_segment_endpoint(request: ProcessSegmentRequest):
     try:
         # 1. Get direct URL
-        info = get_video_info(request.url, request.format_id) 
+        info = await get_video_info_async(request.url, request.format_id)
         direct_url = info['url']
         if not direct_url:
-             direct_url = get_video_url(request.url)
+            raise ValueError("Could not extract a direct video URL.")
+
+        if not request.proxy:
+            redirect = full_video_redirect(info, direct_url, request.start, request.end)
+            if redirect:
+                return redirect
 
         # 2. Stream
         filename = f"video_part_{request.segment_index}.mp4"
         
         # Determine if we should pass audio_url (for high-res video-only streams)
         # We pass it if it exists. processor.py will decide how to use it.
-        return StreamingResponse(
-            stream_video_segment(direct_url, request.start, request.end, info.get('audio_url'), request.url, request.format_id),
-            media_type="video/mp4",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        return await segment_response(
+            lambda: stream_video_segment(direct_url, request.start, request.end, info.get('audio_url'), request.url, request.format_id,
+                                         info.get('vcodec'), info.get('acodec')),
+            filename
         )
 
+    except FFmpegBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BUSY_RETRY_AFTER)})
     except Exception as e:
         logger.error(f"Process segment error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/stream-segment")
 async def stream_segment_get(
+    request: Request,
     url: str, 
     start: int, 
     end: int, 
     segment_index: str, 
-    format_id: str = None
+    format_id: str = None,
+    proxy: bool = False
 ):
     """
     GET version of process-segment to allow direct browser downloads (native progress bar).
+    Pass ?proxy=1 to always stream through the server (e.g. to keep the filename).
     """
     try:
         # 1. Get direct URL
-        # Note: We re-fetch info here. Caching would be better but this is safer for fresh links.
-        info = get_video_info(url, format_id) 
+        # Usually a cache hit right after /analyze (see services/downloader.py)
+        info = await get_video_info_async(url, format_id)
         direct_url = info['url']
         if not direct_url:
-             direct_url = get_video_url(url)
+            raise ValueError("Could not extract a direct video URL.")
+
+        if not proxy:
+            redirect = full_video_redirect(info, direct_url, start, end)
+            if redirect:
+                return redirect
 
         # 2. Stream
         filename = f"video_part_{segment_index}.mp4"
+        if request.headers.get("range"):
+            logger.info("Ignoring Range header on transcoded segment, sending full response")
         
-        return StreamingResponse(
-            stream_video_segment(direct_url, start, end, info.get('audio_url'), url, format_id),
-            media_type="video/mp4",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        return await segment_response(
+            lambda: stream_video_segment(direct_url, start, end, info.get('audio_url'), url, format_id,
+                                         info.get('vcodec'), info.get('acodec')),
+            filename
         )
 
+    except FFmpegBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BUSY_RETRY_AFTER)})
     except Exception as e:
         logger.error(f"Stream segment error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/stream-hls")
+async def stream_hls_get(
+    url: str,
+    start: NonNegativeInt,
+    end: NonNegativeInt,
+    format_id: str = None
+):
+    """
+    Plays a segment as HLS: starts an encode and redirects to its master
+    playlist once the first segment exists, so players can start after
+    ~2 seconds of video instead of waiting on the whole fMP4 stream.
+    """
+    try:
+        info = await get_video_info_async(url, format_id)
+        direct_url = info['url']
+        if not direct_url:
+            raise ValueError("Could not extract a direct video URL.")
+
+        # Reaps old sessions and creates the session dir: blocking file I/O
+        session_id = await run_in_threadpool(start_hls_session, direct_url, start, end, info.get('audio_url'))
+        
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + HLS_READY_TIMEOUT
+            while not hls_playlist_ready(session_id):
+                if loop.time() > deadline:
+                    raise RuntimeError("Timed out waiting for the first HLS segment")
+                await asyncio.sleep(0.1)
+        except Exception:
+            # Nobody will be redirected to it: don't keep encoding for nobody
+            await run_in_threadpool(stop_hls_session, session_id)
+            raise
+
+        return RedirectResponse(f"/hls/{session_id}/index.m3u8", status_code=302)
+
+    except FFmpegBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+    except Exception as e:
+        logger.error(f"Stream HLS error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/process")
 async def process_split_endpoint(request: ProcessRequest, background_tasks: BackgroundTasks):
     try:
         # 1. Get direct URL
-        info = get_video_info(request.url) # Re-using get_video_info to get direct url securely
+        info = await get_video_info_async(request.url) # Re-using get_video_info to get direct url securely
         direct_url = info['url']
         if not direct_url:
              # Fallback if specific extraction fails, though get_video_info wraps standard extraction
-             direct_url = get_video_url(request.url)
+             direct_url = await run_extractor(get_video_url, request.url)
 
         # 2. Split and Zip
-        zip_path = split_video(direct_url, request.chunk_duration)
+        zip_path = await run_ffmpeg_job(split_video, direct_url, request.chunk_duration, precise=request.precise, duration=info.get('duration'), renditions=request.renditions)
         
         # 3. Return file
         filename = os.path.basename(zip_path)
@@ -203,13 +418,25 @@ async def process_split_endpoint(request: ProcessRequest, background_tasks: Back
         return FileResponse(
             path=zip_path, 
             filename=filename, 
-            media_type="application/zip"
+            media_type="application/zip",
+            stat_result=os.stat(zip_path)
         )
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Process split error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers need the app as an import string. Each worker keeps its own extraction cache.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=min(4, os.cpu_count() or 1),
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+    )
@@ -1,11 +1,151 @@
 import yt_dlp
 import logging
 import ffmpeg
+import httpx
+import asyncio
+import bisect
+import collections
+import functools
+import io
+import random
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Extraction results keyed by (canonical url, format_id or 'best') -> (expires_at, info),
+# least recently used first. Entries never outlive the signed CDN URLs inside them.
+_INFO_CACHE_TTL = 240
+_INFO_CACHE_MAX = 1024
+_INFO_CACHE = collections.OrderedDict()
+_INFO_CACHE_LOCK = threading.Lock()
+
+# Expiry safety margin for signed URLs (e.g. googlevideo's expire=)
+_URL_EXPIRY_MARGIN = 30
+
+# Query parameters that only track shares and never change the video
+_TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'igshid'}
+
+# yt-dlp extraction is blocking network I/O; async callers run it here.
+EXTRACTOR_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="extractor")
+
+# Extractions currently running, keyed like _INFO_CACHE, so concurrent
+# requests for the same video share one yt-dlp round-trip.
+_INFLIGHT = {}
+_INFLIGHT_LOCK = asyncio.Lock()
+
+def canonical_url(url: str) -> str:
+    """
+    Normalizes a video URL so trivially different links share a cache entry:
+    lowercase scheme/host, no fragment or share-tracking params, and
+    youtu.be/<id> rewritten to the watch URL.
+    """
+    parts = urlparse(url.strip())
+    host = parts.netloc.lower()
+    path = parts.path
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in _TRACKING_PARAMS and not k.startswith('utm_')]
+    if host in ('youtu.be', 'www.youtu.be') and path.strip('/'):
+        host, query = 'www.youtube.com', [('v', path.strip('/'))] + query
+        path = '/watch'
+    return urlunparse((parts.scheme.lower(), host, path, parts.params, urlencode(query), ''))
+
+def _cache_key(url: str, format_id: str = None):
+    return (canonical_url(url), format_id or 'best')
+
+def _cache_get(key):
+    with _INFO_CACHE_LOCK:
+        entry = _INFO_CACHE.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.time() >= expires_at:
+            del _INFO_CACHE[key]
+            return None
+        _INFO_CACHE.move_to_end(key)
+        return value
+
+def _cache_set(key, value, ttl: float = _INFO_CACHE_TTL):
+    if ttl <= 0:
+        return
+    with _INFO_CACHE_LOCK:
+        _INFO_CACHE[key] = (time.time() + ttl, value)
+        _INFO_CACHE.move_to_end(key)
+        while len(_INFO_CACHE) > _INFO_CACHE_MAX:
+            _INFO_CACHE.popitem(last=False)
+
+def _result_ttl(result: dict) -> float:
+    """
+    Cache lifetime for an extraction: the default TTL, cut short when a signed
+    URL in it carries an earlier expire= timestamp.
+    """
+    ttl = _INFO_CACHE_TTL
+    now = time.time()
+    for media_url in (result.get('url'), result.get('audio_url')):
+        if not media_url:
+            continue
+        expire = dict(parse_qsl(urlparse(media_url).query)).get('expire')
+        if expire and expire.isdigit():
+            ttl = min(ttl, int(expire) - now - _URL_EXPIRY_MARGIN)
+    return ttl
+
+def invalidate(url: str):
+    """
+    Drops every cached extraction for `url` so the next call re-runs yt-dlp.
+    """
+    canonical = canonical_url(url)
+    with _INFO_CACHE_LOCK:
+        for key in [k for k in _INFO_CACHE if k[0] == canonical or k == ('duration', url)]:
+            del _INFO_CACHE[key]
+
+# Every endpoint works on a single video: never walk a whole playlist/channel.
+_SINGLE_VIDEO_OPTS = {
+    'noplaylist': True,
+    'playlist_items': '1',
+    'extract_flat': 'in_playlist',
+}
+
+# Where yt-dlp keeps player JS and signature caches; survives restarts.
+_YDL_CACHE_DIR = '/tmp/yt-dlp-cache'
+
+# Long-lived YoutubeDL instances keep cookies, nsig/signature caches and
+# player JS between extractions. YoutubeDL isn't thread-safe, so every
+# worker thread keeps its own, keyed by the options they were built with.
+_YDL_LOCAL = threading.local()
+_YDL_PER_THREAD = 8
+
+def _ydl(opts: dict):
+    """
+    Returns this thread's YoutubeDL instance for `opts`, creating it on first use.
+    """
+    instances = getattr(_YDL_LOCAL, 'instances', None)
+    if instances is None:
+        instances = _YDL_LOCAL.instances = {}
+    key = repr(sorted(opts.items()))
+    ydl = instances.get(key)
+    if ydl is None:
+        if len(instances) >= _YDL_PER_THREAD:
+            instances.pop(next(iter(instances))).close()
+        ydl = instances[key] = yt_dlp.YoutubeDL(opts)
+    return ydl
+
+def _first_entry(ydl, info):
+    """
+    Reduces a playlist result to its first video.
+    With extract_flat the entry is only a stub, so it gets resolved here.
+    """
+    if not info or info.get('_type') != 'playlist':
+        return info
+    entry = next(iter(info.get('entries') or []), None)
+    if entry and entry.get('_type') == 'url':
+        entry = ydl.extract_info(entry['url'], download=False)
+    return entry
+
 def get_video_url(url: str) -> str:
     """
     Extracts the direct video URL from a Facebook/Instagram/TikTok link using yt-dlp.
@@ -15,27 +155,31 @@ def get_video_url(url: str) -> str:
         'format': 'best',  # Get best quality
         'quiet': True,
         'no_warnings': True,
-        'simulate': True, # Do not download, just extract info
-        'forceurl': True,
+        'skip_download': True, # Do not download, just extract info
         # Use a generic user agent to avoid detection/blocking
         'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'cachedir': _YDL_CACHE_DIR,
+        'socket_timeout': 10,
+        'http_chunk_size': 10 << 20,
+        **_SINGLE_VIDEO_OPTS,
     }
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Extracting info for URL: {url}")
-            info = ydl.extract_info(url, download=False)
-            
-            # yt-dlp returns the direct url in 'url' field for extracting info
-            if 'url' in info:
-                return info['url']
-            else:
-                raise ValueError("Could not find direct video URL in extraction results.")
+        ydl = _ydl(ydl_opts)
+        logger.info(f"Extracting info for URL: {url}")
+        info = _first_entry(ydl, ydl.extract_info(url, download=False))
+        
+        # yt-dlp returns the direct url in 'url' field for extracting info
+        if info and 'url' in info:
+            return info['url']
+        else:
+            raise ValueError("Could not find direct video URL in extraction results.")
                 
     except Exception as e:
         logger.error(f"Error extracting video URL: {str(e)}")
         raise e
 
+import atexit
 import os
 import tempfile
 
@@ -57,156 +201,506 @@ def get_cookie_file():
         logger.error(f"Failed to create cookie file: {e}")
         return None
 
+# Written once at import (the env var can't change while we run) and removed on exit.
+_COOKIE_PATH = get_cookie_file()
+if _COOKIE_PATH:
+    atexit.register(os.unlink, _COOKIE_PATH)
+
+# player_client orderings tried for YouTube URLs. None means yt-dlp's defaults,
+# which return the most formats (1080p, 720p, etc.) with direct URLs.
+_CLIENT_STRATEGIES = (None, ('web',), ('android',), ('ios',), ('tv',), ('mweb',))
+
+# Beta(successes, failures) posterior per (host, clients). Strategies are
+# ordered by a sample from each (Thompson sampling), so every host converges
+# on its best client while the others still get the occasional try.
+# yt-dlp's defaults return the most formats, so they start slightly ahead.
+_CLIENT_PRIORS = {None: (2, 1)}
+_CLIENT_POSTERIOR = {}
+_CLIENT_POSTERIOR_LOCK = threading.Lock()
+
+# Strategies are tried in ranked order, at most this many at once per
+# extraction; the next one starts as soon as an attempt fails. Kept below
+# the number of strategies so the learned ordering decides who goes first.
+# Each attempt is bounded by yt-dlp's socket_timeout.
+_PARALLEL_STRATEGIES = 2
+# get_video_info already runs inside EXTRACTOR_POOL, so the attempts get
+# their own pool to avoid starving it. Its threads are long-lived, so the
+# per-thread YoutubeDL instances from _ydl() are reused across extractions.
+_STRATEGY_POOL = ThreadPoolExecutor(max_workers=12, thread_name_prefix="yt-client")
+
+def _is_youtube_host(host: str) -> bool:
+    return 'youtube.com' in host or 'youtu.be' in host
+
+def _posterior(host: str, clients):
+    return _CLIENT_POSTERIOR.get((host, clients)) or _CLIENT_PRIORS.get(clients, (1, 1))
+
+def _record_attempt(host: str, clients, success: bool):
+    with _CLIENT_POSTERIOR_LOCK:
+        a, b = _posterior(host, clients)
+        _CLIENT_POSTERIOR[(host, clients)] = (a + 1, b) if success else (a, b + 1)
+
+def _client_strategies(url: str):
+    """
+    Returns (host, strategies) ordered by a Thompson sample of past success.
+    Only YouTube honours player_client, so other hosts get a single attempt.
+    """
+    host = urlparse(url).netloc
+    if not _is_youtube_host(host):
+        return host, [None]
+    with _CLIENT_POSTERIOR_LOCK:
+        scores = {c: random.betavariate(*_posterior(host, c)) for c in _CLIENT_STRATEGIES}
+    return host, sorted(_CLIENT_STRATEGIES, key=lambda c: -scores[c])
+
+def _has_format(info: dict, format_id: str) -> bool:
+    return any(f.get('format_id') == format_id for f in info.get('formats', []))
+
+def _try_extract(url: str, clients, ydl_opts: dict):
+    """
+    Runs one yt-dlp extraction, optionally pinned to a player_client list.
+    Returns the raw info dict, or None if the attempt failed.
+    """
+    opts = dict(ydl_opts)
+    if clients:
+        opts['extractor_args'] = {'youtube': {'player_client': list(clients)}}
+    label = ','.join(clients) if clients else 'defaults'
+    logger.info(f"Extracting video info with yt-dlp {label}...")
+
+    try:
+        ydl = _ydl(opts)
+        return _first_entry(ydl, ydl.extract_info(url, download=False))
+    except Exception as e:
+        logger.warning(f"Extraction with {label} failed: {e}")
+        return None
+
+def _race_strategies(url: str, host: str, strategies, ydl_opts: dict, format_id: str = None):
+    """
+    Runs the strategies in ranked order, _PARALLEL_STRATEGIES at a time.
+    Returns (clients, info, partial): the first strategy whose result offers
+    the requested format, and any result that lacked it.
+    """
+    partial = None
+    queued = list(strategies)
+    running = {}
+    try:
+        while queued or running:
+            while queued and len(running) < _PARALLEL_STRATEGIES:
+                clients = queued.pop(0)
+                running[_STRATEGY_POOL.submit(_try_extract, url, clients, ydl_opts)] = clients
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                clients = running.pop(future)
+                info = future.result()
+                if not info:
+                    _record_attempt(host, clients, success=False)
+                    continue
+                # A client that doesn't offer the requested format is only a last resort
+                if format_id and not _has_format(info, format_id):
+                    partial = partial or info
+                    continue
+                return clients, info, partial
+        return None, None, partial
+    finally:
+        # Attempts already running can't be interrupted; this drops queued ones
+        for future in running:
+            future.cancel()
+
 def get_video_info(url: str, format_id: str = None):
     """
     Extracts video metadata (duration, title, etc) + direct URL.
     Returns a dict with 'duration' (seconds) and 'url'.
+    Successful results are cached for a few minutes per (url, format_id).
     """
-    cookie_file = get_cookie_file()
+    cached = _cache_get(_cache_key(url, format_id))
+    if cached is not None:
+        logger.info(f"Using cached video info for {url}")
+        return cached
+
+    cookie_file = _COOKIE_PATH
     
     ydl_opts = {
         # 'format': 'best', # REMOVED: restricting to 'best' breaks DASH extraction on web client
         'quiet': True,
         'no_warnings': True,
-        'simulate': True,
+        'skip_download': True,
         # 'forceurl': True, # REMOVED: this forces format resolution which fails on DASH split streams
         'nocheckcertificate': True,
-        'ignoreerrors': True,
         'geo_bypass': True,
         'force_ipv4': True,
-        'quiet': True,
+        'cachedir': _YDL_CACHE_DIR,
+        'socket_timeout': 10,
+        'http_chunk_size': 10 << 20,
+        **_SINGLE_VIDEO_OPTS,
     }
     
     if cookie_file:
         logger.info(f"Using cookies from environment variable")
         ydl_opts['cookiefile'] = cookie_file
 
-    # No client restriction - let yt-dlp use its defaults
-    # This returns the most formats (1080p, 720p, etc.) with direct URLs
-    logger.info("Extracting video info with yt-dlp defaults...")
+    host, strategies = _client_strategies(url)
+    clients, info, partial = _race_strategies(url, host, strategies, ydl_opts, format_id)
+    if info:
+        _record_attempt(host, clients, success=True)
+
+    info = info or partial
+    if not info:
+        logger.error("No video info returned")
+        return {"title": "Error", "duration": 0, "url": None, "formats": []}
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            if info:
-                    logger.info("Successfully extracted video info")
-                    duration = info.get('duration')
-                    # Fallback for duration
-                    if not duration:
-                         try:
-                             probe = ffmpeg.probe(url)
-                             duration = float(probe['format']['duration'])
-                         except:
-                             duration = 0
-                    
-                    # Extract formats
-                    formats = []
-                    if 'formats' in info:
-                        for f in info['formats']:
-                            # Filter for ANY video file (webm, mp4, etc.)
-                            # ffmpeg will re-encode to mp4 for output anyway.
-                                # Normalize resolution availability
-                                h = f.get('height') or 0
-                                if h == 0:
-                                    continue
-                                    
-                                label = f"{h}p"
-                                
-                                # Standard resolutions mapping
-                                if 1000 <= h <= 1100: label = "1080p"
-                                elif 700 <= h <= 750: label = "720p"
-                                elif 450 <= h <= 500: label = "480p"
-                                elif 330 <= h <= 390: label = "360p"
-                                elif 220 <= h <= 270: label = "240p"
-                                elif 130 <= h <= 160: label = "144p"
-                                
-                                if f.get('filesize'):
-                                    size_mb = f.get('filesize') / (1024 * 1024)
-                                    label += f" ({size_mb:.1f}MB)"
-                                
-                                # Mark if it's video-only
-                                if f.get('acodec') == 'none':
-                                    label += " (Video Only)"
-                                
-                                formats.append({
-                                    "format_id": f.get('format_id'),
-                                    "resolution": f"{f.get('width')}x{f.get('height')}",
-                                    "height": h,
-                                    "label": label,
-                                    "ext": f.get('ext')
-                                })
-                    
-                    # Dedup by height, keeping best quality usually at end of list
-                    # Reverse to show highest first? frontend can handle sort.
-                    # Let's clean up: unique by height.
-                    unique_formats = {}
-                    for f in formats:
-                        unique_formats[f['height']] = f
-                    
-                    # Sort by height descending
-                    sorted_formats = sorted(unique_formats.values(), key=lambda x: x['height'], reverse=True)
-
-                    selected_url = info.get('url')
-                    audio_url = None
-                    
-                    # Helper to check if URL is an HLS manifest (not directly streamable by ffmpeg for trimming)
-                    def is_hls_url(url):
-                        return url and ('.m3u8' in url or 'manifest' in url)
-                    
-                    # If format_id is provided, find that specific stream
-                    if format_id:
-                        for f in info.get('formats', []):
-                            if f.get('format_id') == format_id:
-                                selected_url = f.get('url')
-                                logger.info(f"Selected specific format: {format_id} ({f.get('height')}p)")
-                                break
-                    
-                    # CRITICAL: If selected_url is HLS manifest, find a direct URL instead
-                    # HLS manifests don't work well with ffmpeg -ss for trimming
-                    if is_hls_url(selected_url):
-                        logger.warning(f"Got HLS manifest URL, searching for direct URL...")
-                        # Look for a direct MP4 URL with video+audio (progressive)
-                        for f in info.get('formats', []):
-                            url = f.get('url')
-                            if url and not is_hls_url(url) and f.get('height') and f.get('acodec') != 'none':
-                                selected_url = url
-                                logger.info(f"Found direct progressive URL: {f.get('format_id')} ({f.get('height')}p)")
-                                break
-                        
-                        # If still HLS, try any direct video URL (even video-only)
-                        if is_hls_url(selected_url):
-                            for f in info.get('formats', []):
-                                url = f.get('url')
-                                if url and not is_hls_url(url) and f.get('height'):
-                                    selected_url = url
-                                    logger.info(f"Found direct video-only URL: {f.get('format_id')} ({f.get('height')}p)")
-                                    break
-                    
-                    # Always try to find a separate audio track (bestaudio)
-                    # This is needed if the selected video stream is video-only (e.g. 1080p, 4K)
-                    # We look for m4a/aac usually for better compatibility or just best audio
-                    for f in info.get('formats', []):
-                        url = f.get('url')
-                        if f.get('vcodec') == 'none' and f.get('acodec') != 'none' and url and not is_hls_url(url):
-                            # Found an audio-only stream with direct URL
-                            # Prefer m4a if available, else take any
-                            audio_url = url
-                            if f.get('ext') == 'm4a':
-                                break 
-                                
-                    return {
-                        'url': selected_url,
-                        'audio_url': audio_url,
-                        'duration': duration,
-                        'title': info.get('title', 'video'),
-                        'formats': sorted_formats
-                    }
-            
-            # If info is None/empty
-            logger.error("No video info returned")
-            return {"title": "Error", "duration": 0, "url": None, "formats": []}
-                    
+        result = _summarize_info(url, info, format_id)
     except Exception as e:
         logger.error(f"Extraction failed: {e}")
         return {"title": "Error", "duration": 0, "url": None, "formats": []}
+
+    _cache_set(_cache_key(url, format_id), result, _result_ttl(result))
+    return result
+
+class _RangedStream(io.RawIOBase):
+    """
+    Reads a URL as consecutive Range requests of `chunk_size` bytes, as
+    yt-dlp's HTTP downloader does for formats whose downloader_options set
+    http_chunk_size: googlevideo throttles or cuts off long unranged reads.
+    """
+    def __init__(self, ydl, url: str, headers: dict, chunk_size: int):
+        self._ydl = ydl
+        self._url = url
+        self._headers = headers
+        self._chunk_size = chunk_size
+        self._pos = 0
+        self._total = None  # from Content-Range; None until known
+        self._response = None
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def _open_next(self) -> bool:
+        if self._done or (self._total is not None and self._pos >= self._total):
+            return False
+        headers = {**self._headers, 'Range': f'bytes={self._pos}-{self._pos + self._chunk_size - 1}'}
+        try:
+            self._response = self._ydl.urlopen(yt_dlp.networking.Request(self._url, headers=headers))
+        except yt_dlp.networking.exceptions.HTTPError as e:
+            if e.status == 416:  # Range starts past the end
+                return False
+            raise
+        total = (self._response.headers.get('Content-Range') or '').rpartition('/')[2]
+        if self._response.status == 206 and total.isdigit():
+            self._total = int(total)
+        else:
+            # Range ignored (or size unknown): this response is the whole rest
+            self._done = True
+        return True
+
+    def readinto(self, buffer) -> int:
+        while True:
+            if self._response is None and not self._open_next():
+                return 0
+            data = self._response.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self._pos += len(data)
+                return len(data)
+            self._response.close()
+            self._response = None
+
+    def close(self):
+        super().close()
+        if self._response is not None:
+            self._response.close()
+
+def open_format_streams(url: str, format_spec: str) -> list:
+    """
+    Resolves `format_spec` (yt-dlp syntax, e.g. "137+bestaudio/best") for url
+    and opens the selected stream(s) through yt-dlp's own HTTP stack, so its
+    cookies and per-format headers apply. Runs in-process: no CLI start-up.
+    Returns readable responses, video first, then audio for merged formats.
+    Formats with an http_chunk_size downloader option are fetched in Range
+    chunks of that size, like yt-dlp's own downloader does.
+    """
+    # No 'format' here: the spec differs per request, and it would otherwise
+    # key a separate cached YoutubeDL (player JS and all) per spec per thread
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'cachedir': _YDL_CACHE_DIR,
+        'socket_timeout': 10,
+        **_SINGLE_VIDEO_OPTS,
+    }
+    if _COOKIE_PATH:
+        ydl_opts['cookiefile'] = _COOKIE_PATH
+    
+    ydl = _ydl(ydl_opts)
+    info = _first_entry(ydl, ydl.extract_info(url, download=False))
+    formats = (info or {}).get('formats') or []
+    ctx = {
+        'formats': formats,
+        'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+        'incomplete_formats': all(f.get('vcodec') == 'none' for f in formats) or all(f.get('acodec') == 'none' for f in formats),
+    }
+    selected = next(iter(ydl.build_format_selector(format_spec)(ctx)), None) if formats else info
+    if not selected:
+        raise ValueError("Could not resolve a downloadable format.")
+    
+    streams = []
+    try:
+        for f in selected.get('requested_formats') or [selected]:
+            headers = f.get('http_headers') or {}
+            chunk_size = (f.get('downloader_options') or {}).get('http_chunk_size')
+            if chunk_size:
+                streams.append(_RangedStream(ydl, f['url'], headers, chunk_size))
+            else:
+                streams.append(ydl.urlopen(yt_dlp.networking.Request(f['url'], headers=headers)))
+    except Exception:
+        for stream in streams:
+            stream.close()
+        raise
+    return streams
+
+# Heights that snap to a standard label: (min_height, max_height, label), ascending.
+_LABEL_BUCKETS = (
+    (130, 160, "144p"),
+    (220, 270, "240p"),
+    (330, 390, "360p"),
+    (450, 500, "480p"),
+    (700, 750, "720p"),
+    (1000, 1100, "1080p"),
+)
+_LABEL_BUCKET_STARTS = [bucket[0] for bucket in _LABEL_BUCKETS]
+
+def _resolution_label(h: int) -> str:
+    """Maps a pixel height to its standard label, e.g. 1088 -> "1080p"."""
+    i = bisect.bisect_right(_LABEL_BUCKET_STARTS, h) - 1
+    if i >= 0 and h <= _LABEL_BUCKETS[i][1]:
+        return _LABEL_BUCKETS[i][2]
+    return f"{h}p"
+
+@functools.lru_cache(maxsize=1024)
+def _format_label(h: int, filesize: int | None, video_only: bool) -> str:
+    """Builds the dropdown label for a format, e.g. "1080p (52.3MB) (Video Only)"."""
+    label = _resolution_label(h)
+
+    if filesize:
+        size_mb = filesize / (1024 * 1024)
+        label += f" ({size_mb:.1f}MB)"
+
+    # Mark if it's video-only
+    if video_only:
+        label += " (Video Only)"
+    return label
+
+# The moov atom of a "faststart" mp4 sits in the first few hundred KB.
+_MOOV_PROBE_BYTES = 256 * 1024
+
+# Shared keep-alive client for our own HTTP probes, so repeat probes to the
+# same CDN skip the TCP/TLS handshake.
+_HTTP = httpx.Client(
+    http2=True,
+    timeout=10.0,
+    follow_redirects=True,
+    limits=httpx.Limits(max_keepalive_connections=32),
+    headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+)
+
+def _mp4_boxes(data: bytes, start: int, end: int):
+    """
+    Yields (type, payload_start, payload_end) for the MP4 boxes in data[start:end].
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+def _parse_mvhd_duration(data: bytes):
+    """
+    Returns the moov/mvhd duration in seconds from the head of an mp4, or None.
+    """
+    for kind, start, end in _mp4_boxes(data, 0, len(data)):
+        if kind != b'moov':
+            continue
+        for inner, istart, iend in _mp4_boxes(data, start, end):
+            if inner != b'mvhd':
+                continue
+            try:
+                if data[istart] == 1:
+                    timescale, duration = struct.unpack('>IQ', data[istart + 20:istart + 32])
+                else:
+                    timescale, duration = struct.unpack('>II', data[istart + 12:istart + 20])
+            except struct.error:
+                return None
+            return duration / timescale if timescale else None
+    return None
+
+def _probe_duration(url: str):
+    """
+    Reads the duration from the mp4 header with a single range request.
+    """
+    data = bytearray()
+    headers = {'Range': f'bytes=0-{_MOOV_PROBE_BYTES - 1}'}
+    with _HTTP.stream('GET', url, headers=headers) as response:
+        response.raise_for_status()
+        # Stop reading even if the server ignores Range and sends everything
+        for chunk in response.iter_bytes():
+            data += chunk
+            if len(data) >= _MOOV_PROBE_BYTES:
+                break
+    return _parse_mvhd_duration(bytes(data[:_MOOV_PROBE_BYTES]))
+
+def _fallback_duration(url: str, info: dict):
+    """
+    Duration for extractions that didn't report one: the formats first, then
+    the mp4 header, with a full ffprobe only as a last resort.
+    """
+    for f in info.get('formats') or []:
+        if f.get('duration'):
+            return f['duration']
+
+    key = ('duration', url)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    duration = 0
+    try:
+        duration = _probe_duration(url)
+    except Exception as e:
+        logger.warning(f"mp4 header probe failed: {e}")
+
+    if not duration:
+        try:
+            probe = ffmpeg.probe(url)
+            duration = float(probe['format']['duration'])
+        except:
+            duration = 0
+
+    if duration:
+        _cache_set(key, duration)
+    return duration
+
+def _summarize_info(url: str, info: dict, format_id: str = None) -> dict:
+    """
+    Reduces a raw yt-dlp info dict to the fields the API needs:
+    direct video/audio URLs and their codecs, duration, title and the format list.
+    """
+    logger.info("Successfully extracted video info")
+    duration = info.get('duration') or _fallback_duration(url, info)
+
+    # Helper to check if URL is an HLS manifest (not directly streamable by ffmpeg for trimming)
+    def is_hls_url(url):
+        return url and ('.m3u8' in url or 'manifest' in url)
+
+    selected_url = info.get('url')
+    chosen = info
+    selected = None
+    progressive = None
+    direct_video = None
+    audio_url = None
+    audio_acodec = None
+    audio_is_m4a = False
+
+    # Single pass over the formats: build the deduped format list, and pick
+    # the requested stream, direct (non-HLS) fallbacks and the audio track.
+    # The last entry per height wins: yt-dlp lists best quality last.
+    best_by_height = {}
+    for f in info.get('formats') or []:
+        f_url = f.get('url')
+        direct = f_url and not is_hls_url(f_url)
+        h = f.get('height') or 0
+        acodec = f.get('acodec')
+
+        if format_id and selected is None and f.get('format_id') == format_id:
+            selected = f
+
+        if direct and h:
+            if direct_video is None:
+                direct_video = f
+            if progressive is None and acodec != 'none':
+                progressive = f
+
+        # Always try to find a separate audio track (bestaudio)
+        # This is needed if the selected video stream is video-only (e.g. 1080p, 4K)
+        # Prefer m4a if available, else take any
+        if direct and not audio_is_m4a and f.get('vcodec') == 'none' and acodec != 'none':
+            audio_url = f_url
+            audio_acodec = acodec
+            audio_is_m4a = f.get('ext') == 'm4a'
+
+        # Filter for ANY video file (webm, mp4, etc.)
+        # ffmpeg will re-encode to mp4 for output anyway.
+        if h:
+            best_by_height[h] = f
+
+    # Entries (and their labels) are built once per height, highest first
+    sorted_formats = [
+        {
+            "format_id": f.get('format_id'),
+            "resolution": f"{f.get('width')}x{h}",
+            "height": h,
+            "label": _format_label(h, f.get('filesize'), f.get('acodec') == 'none'),
+            "ext": f.get('ext')
+        }
+        for h, f in sorted(best_by_height.items(), reverse=True)
+    ]
+
+    # If format_id is provided, use that specific stream
+    if selected is not None:
+        chosen = selected
+        selected_url = selected.get('url')
+        logger.info(f"Selected specific format: {format_id} ({selected.get('height')}p)")
+
+    # CRITICAL: If selected_url is HLS manifest, use a direct URL instead
+    # HLS manifests don't work well with ffmpeg -ss for trimming
+    if is_hls_url(selected_url):
+        logger.warning(f"Got HLS manifest URL, searching for direct URL...")
+        # Prefer a direct MP4 URL with video+audio (progressive),
+        # else any direct video URL (even video-only)
+        fallback = progressive or direct_video
+        if fallback is not None:
+            chosen = fallback
+            selected_url = fallback.get('url')
+            kind = "progressive" if fallback is progressive else "video-only"
+            logger.info(f"Found direct {kind} URL: {fallback.get('format_id')} ({fallback.get('height')}p)")
+
+    return {
+        'url': selected_url,
+        'audio_url': audio_url,
+        # Codecs of the streams above; the audio comes from audio_url when there is one
+        'vcodec': chosen.get('vcodec'),
+        'acodec': audio_acodec if audio_url else chosen.get('acodec'),
+        'duration': duration,
+        'title': info.get('title', 'video'),
+        'formats': sorted_formats
+    }
+
+async def get_video_info_async(url: str, format_id: str = None):
+    """
+    Awaitable get_video_info that runs in EXTRACTOR_POOL.
+    Concurrent calls with the same (url, format_id) await a single extraction.
+    """
+    key = _cache_key(url, format_id)
+    async with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        owner = future is None
+        if owner:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(EXTRACTOR_POOL, get_video_info, url, format_id)
+            _INFLIGHT[key] = future
+
+    try:
+        # Shield so one disconnecting client doesn't cancel the shared extraction
+        return await asyncio.shield(future)
+    finally:
+        if owner:
+            _INFLIGHT.pop(key, None)
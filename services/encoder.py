@@ -0,0 +1,79 @@
+import os
+import logging
+import subprocess
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Preferred H.264 encoders, fastest first. libx264 (CPU) always works.
+CANDIDATES = ['h264_nvenc', 'h264_qsv', 'h264_vaapi', 'libx264']
+
+VAAPI_DEVICE = os.environ.get('VAAPI_DEVICE', '/dev/dri/renderD128')
+
+# libx264 preset -> closest preset of each hardware encoder
+_NVENC_PRESETS = {'superfast': 'p2', 'fast': 'p4'}
+_QSV_PRESETS = {'superfast': 'veryfast', 'fast': 'fast'}
+
+def _global_args_for(encoder: str) -> list:
+    if encoder == 'h264_vaapi':
+        return ['-vaapi_device', VAAPI_DEVICE]
+    return []
+
+def _encoder_works(encoder: str) -> bool:
+    """
+    Encodes one tiny frame; `ffmpeg -encoders` also lists encoders whose
+    hardware/driver is missing, so a listing alone isn't enough.
+    """
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', *_global_args_for(encoder),
+           '-f', 'lavfi', '-i', 'color=s=256x256:d=0.1',
+           '-frames:v', '1', '-c:v', encoder]
+    if encoder == 'h264_vaapi':
+        cmd += ['-vf', 'format=nv12,hwupload']
+    cmd += ['-f', 'null', '-']
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=15).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+def detect_encoder() -> str:
+    """
+    Returns the first usable encoder in CANDIDATES.
+    Set VIDEO_ENCODER to skip detection and force one.
+    """
+    forced = os.environ.get('VIDEO_ENCODER')
+    if forced:
+        return forced
+
+    try:
+        listing = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                 capture_output=True, text=True, timeout=15).stdout
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not list ffmpeg encoders: {e}")
+        return 'libx264'
+
+    for encoder in CANDIDATES[:-1]:
+        if f" {encoder} " in listing and _encoder_works(encoder):
+            return encoder
+    return 'libx264'
+
+# Probed once per process
+ENCODER = detect_encoder()
+logger.info(f"Using video encoder: {ENCODER}")
+
+def global_args() -> list:
+    """ffmpeg global options ENCODER needs (e.g. the VAAPI device)."""
+    return _global_args_for(ENCODER)
+
+def video_encode_args(preset: str = 'fast', crf: int = 23) -> dict:
+    """
+    ffmpeg output options for ENCODER at roughly libx264 `preset`/`crf` quality.
+    """
+    if ENCODER == 'h264_nvenc':
+        return {'vcodec': ENCODER, 'preset': _NVENC_PRESETS.get(preset, 'p4'), 'rc': 'vbr', 'cq': crf}
+    if ENCODER == 'h264_qsv':
+        return {'vcodec': ENCODER, 'preset': _QSV_PRESETS.get(preset, 'fast'), 'global_quality': crf}
+    if ENCODER == 'h264_vaapi':
+        # Frames are decoded in software and uploaded to the GPU for encoding
+        return {'vcodec': ENCODER, 'vf': 'format=nv12,hwupload', 'qp': crf}
+    return {'vcodec': ENCODER, 'preset': preset, 'crf': crf}
@@ -1,16 +1,106 @@
 import ffmpeg
 import os
-import uuid
+import itertools
+import time
 import logging
+import mmap
 import zipfile
+import zlib
 import shutil
 import glob
+import secrets
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.encoder import ENCODER, global_args, video_encode_args
+from services.downloader import open_format_streams
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def process_video(direct_url: str, start_time: int, end_time: int, output_dir: str = "temp") -> str:
+# Work files go to disk by default. Hosts with RAM to spare can point VS_TEMP
+# at tmpfs (e.g. /dev/shm/video_splitter): segments and their ZIP are then
+# held in memory, which small instances (512 MB, Docker's 64 MB /dev/shm) can't afford.
+TEMP_ROOT = os.environ.get('VS_TEMP', 'temp')
+os.makedirs(TEMP_ROOT, exist_ok=True)
+
+# Temp file names only need to be unique within the temp dir, not random:
+# pid + start time + a counter (next() on itertools.count is atomic in CPython)
+_NAME_PREFIX = f"{os.getpid()}_{int(time.time())}"
+_name_counter = itertools.count()
+
+def _unique_name() -> str:
+    return f"{_NAME_PREFIX}_{next(_name_counter)}"
+
+# A cut this close to a keyframe is stream-copied instead of re-encoded
+KEYFRAME_TOLERANCE = 0.5
+
+# Cores this process may use (cgroup/affinity-aware where the OS exposes it)
+CPUS = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+# ffmpeg encodes allowed at once; each gets an equal share of the cores so
+# concurrent requests don't oversubscribe the CPU with auto-sized thread pools
+MAX_CONCURRENT_FFMPEG = int(os.environ.get('MAX_CONCURRENT_FFMPEG', 4))
+FFMPEG_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_FFMPEG)
+FFMPEG_THREADS = max(1, CPUS // MAX_CONCURRENT_FFMPEG)
+
+# Blocking jobs (process_video, split_video) wait for a slot in here rather
+# than in the server's shared threadpool, which streaming responses need
+# to make progress and release their slots
+FFMPEG_JOB_POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FFMPEG, thread_name_prefix="ffmpeg-job")
+
+class FFmpegBusyError(RuntimeError):
+    """Raised when a stream finds every FFMPEG_SLOTS slot taken."""
+
+def _take_slot():
+    """Takes an FFMPEG_SLOTS slot without waiting, or raises FFmpegBusyError."""
+    if not FFMPEG_SLOTS.acquire(blocking=False):
+        raise FFmpegBusyError("All ffmpeg slots are busy, try again shortly")
+
+def _thread_args(threads: int = FFMPEG_THREADS) -> dict:
+    """ffmpeg output options pinning the encoder to `threads` threads."""
+    args = {'threads': threads, 'thread_type': 'slice+frame'}
+    if ENCODER == 'libx264':
+        args['x264-params'] = f'sliced-threads=1:threads={threads}'
+    return args
+
+def _global_args(threads: int = FFMPEG_THREADS) -> list:
+    """global_args() plus filter thread counts matching `threads`."""
+    return [*global_args(), '-filter_threads', str(threads), '-filter_complex_threads', str(threads)]
+
+def keyframes(url: str, around: float, window: float = 2.0) -> list:
+    """
+    Returns video keyframe timestamps within `window` seconds of `around`.
+    Only that stretch of the input is read, so it stays cheap on remote URLs.
+    """
+    import subprocess
+    
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        '-read_intervals', f'{max(0, around - window)}%+{2 * window}',
+        url
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Keyframe probe failed: {e}")
+        return []
+    
+    times = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(',')
+        if flags.startswith('K') and pts not in ('', 'N/A'):
+            times.append(float(pts))
+    return times
+
+def process_video(direct_url: str, start_time: int, end_time: int, output_dir: str = TEMP_ROOT) -> str:
     """
     Downloads and trims a video from a direct URL using ffmpeg.
     
@@ -28,7 +118,7 @@ def process_video(direct_url: str, start_time: int, end_time: int, output_dir: s
     os.makedirs(output_dir, exist_ok=True)
     
     # Generate unique filename
-    filename = f"{uuid.uuid4()}.mp4"
+    filename = f"{_unique_name()}.mp4"
     output_path = os.path.join(output_dir, filename)
     
     duration = end_time - start_time
@@ -37,42 +127,229 @@ def process_video(direct_url: str, start_time: int, end_time: int, output_dir: s
 
     logger.info(f"Processing video: {direct_url} | Start: {start_time}, Duration: {duration}")
 
-    try:
-        # Construct ffmpeg stream
-        # -ss searches to start_time
-        # -t specifies duration
-        # -c copy attempts to stream copy (fast, no re-encode)
-        # We put -ss before input for faster seeking, but with remote URLs sometimes accurate seek is better after.
-        # However, for remote files, input seeking is usually standard for trimming.
+    with FFMPEG_SLOTS:
+        try:
+            # Construct ffmpeg stream
+            # -ss searches to start_time
+            # -t specifies duration
+            # -c copy attempts to stream copy (fast, no re-encode)
+            # We put -ss before input for faster seeking, but with remote URLs sometimes accurate seek is better after.
+            # However, for remote files, input seeking is usually standard for trimming.
         
-        # Note: 'c="copy"' might be problematic if keyframes don't align. 
-        # If precision is needed, we should re-encode. The prompt implies re-encoding if precision needed.
-        # Let's try re-encoding with libx264 for safety and precision, as 'copy' on random segments often leads to frozen frames at start.
-        # But 'fast' was requested. Let's try copy first? No, prompt says: "or re-encode using libx264 if precision is needed."
-        # Safe bet for cutting specific timestamps is re-encoding.
+            # Note: 'c="copy"' might be problematic if keyframes don't align. 
+            # If precision is needed, we should re-encode. The prompt implies re-encoding if precision needed.
+            # Let's try re-encoding with libx264 for safety and precision, as 'copy' on random segments often leads to frozen frames at start.
+            # But 'fast' was requested. Let's try copy first? No, prompt says: "or re-encode using libx264 if precision is needed."
+            # Safe bet for cutting specific timestamps is re-encoding.
+            # Exception: when the start is (nearly) on a keyframe, copy is exact enough and ~50x faster.
+            nearest = min(keyframes(direct_url, start_time), key=lambda kf: abs(kf - start_time), default=None)
+            if nearest is not None and abs(nearest - start_time) < KEYFRAME_TOLERANCE:
+                try:
+                    (
+                        ffmpeg
+                        .input(direct_url, ss=nearest, t=end_time - nearest)
+                        .output(output_path, c='copy', avoid_negative_ts='make_zero')
+                        .overwrite_output()
+                        .run(capture_stdout=True, capture_stderr=True)
+                    )
+                    logger.info(f"Video processed successfully (stream copy from keyframe at {nearest}s): {output_path}")
+                    return output_path
+                except ffmpeg.Error as e:
+                    logger.warning(f"Stream copy failed, re-encoding: {e.stderr.decode('utf8') if e.stderr else str(e)}")
         
-        (
-            ffmpeg
-            .input(direct_url, ss=start_time, t=duration)
-            .output(output_path, vcodec='libx264', preset='fast', crf=23, acodec='aac')
-            .overwrite_output()
-            .run(capture_stdout=True, capture_stderr=True)
-        )
+            (
+                ffmpeg
+                .input(direct_url, ss=start_time, t=duration)
+                .output(output_path, acodec='aac', **video_encode_args('fast', 23), **_thread_args())
+                .global_args(*_global_args())
+                .overwrite_output()
+                .run(capture_stdout=True, capture_stderr=True)
+            )
         
-        logger.info(f"Video processed successfully: {output_path}")
-        return output_path
+            logger.info(f"Video processed successfully: {output_path}")
+            return output_path
         
-    except ffmpeg.Error as e:
-        logger.error(f"FFmpeg error: {e.stderr.decode('utf8') if e.stderr else str(e)}")
-        raise RuntimeError(f"FFmpeg processing failed: {e.stderr.decode('utf8') if e.stderr else str(e)}")
+        except ffmpeg.Error as e:
+            logger.error(f"FFmpeg error: {e.stderr.decode('utf8') if e.stderr else str(e)}")
+            raise RuntimeError(f"FFmpeg processing failed: {e.stderr.decode('utf8') if e.stderr else str(e)}")
+
+# Hardware encoders cap concurrent sessions (NVENC on consumer cards allows only a few)
+MAX_HW_ENCODES = 3
+
+def _http_input_opts(url: str) -> dict:
+    """Reconnect options for remote inputs; local files don't accept them."""
+    if url.startswith(('http://', 'https://')):
+        return {'reconnect': 1, 'reconnect_delay_max': 5}
+    return {}
+
+def _encode_range(direct_url: str, start: float, length: float, output_path: str, threads: int = FFMPEG_THREADS):
+    (
+        ffmpeg
+        .input(direct_url, ss=start, t=length, **_http_input_opts(direct_url))
+        .output(output_path, acodec='aac', **video_encode_args('fast'), **_thread_args(threads))
+        .global_args(*_global_args(threads))
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+def _split_parallel(direct_url: str, chunk_duration: int, duration: float, work_dir: str):
+    """
+    Encodes every chunk in its own ffmpeg process, several at once.
+    Chunks are independent, so this scales with cores instead of
+    encoding the whole video serially in one process. The job's
+    FFMPEG_THREADS share of the cores is divided between the processes.
+    """
+    if chunk_duration <= 0:
+        raise ValueError("Chunk duration must be positive.")
+    jobs = []
+    start = 0
+    while start < duration:
+        jobs.append((len(jobs), start, min(chunk_duration, duration - start)))
+        start += chunk_duration
+    
+    workers = min(FFMPEG_THREADS, len(jobs))
+    if ENCODER != 'libx264':
+        workers = min(workers, MAX_HW_ENCODES)
+    threads = max(1, FFMPEG_THREADS // workers)
+    logger.info(f"Encoding {len(jobs)} segments with {workers} parallel ffmpeg processes ({threads} threads each)")
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_encode_range, direct_url, seg_start, length, os.path.join(work_dir, f"segment_{idx:03d}.mp4"), threads)
+            for idx, seg_start, length in jobs
+        ]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except Exception:
+            # One chunk failed: don't start the queued ones
+            for future in futures:
+                future.cancel()
+            raise
+
+def _cli_args(options: dict) -> list:
+    """Turns ffmpeg-python style output options into command-line arguments."""
+    args = []
+    for key, value in options.items():
+        args += [f"-{'c:v' if key == 'vcodec' else key}", str(value)]
+    return args
+
+# Heights a rendition ladder may use: all even (libx264 rejects odd heights)
+# and no taller than 4K
+RENDITION_HEIGHTS = (2160, 1440, 1080, 720, 480, 360, 240, 144)
+
+def _split_renditions(direct_url: str, chunk_duration: int, heights: list, work_dir: str):
+    """
+    Splits into chunks at several resolutions in one ffmpeg process.
+    The input is decoded once and fanned out with the split filter,
+    instead of being re-decoded for every rendition.
+    Writes <height>p_<nnn>.mp4 files into work_dir.
+    """
+    import subprocess
+    
+    encode_args = video_encode_args('fast')
+    # VAAPI's hwupload has to join the filter graph; -vf can't be combined with it
+    upload = ',' + encode_args.pop('vf') if 'vf' in encode_args else ''
+    
+    labels = ''.join(f'[v{i}]' for i in range(len(heights)))
+    graph = [f'[0:v]split={len(heights)}{labels}']
+    graph += [f'[v{i}]scale=-2:{h}{upload}[out{i}]' for i, h in enumerate(heights)]
+    
+    codec_args = _cli_args({**encode_args, **_thread_args()})
+    
+    # python-ffmpeg's graph API doesn't express filter_complex + several segment outputs well
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *_global_args(),
+           '-i', direct_url, '-filter_complex', ';'.join(graph)]
+    for i, h in enumerate(heights):
+        cmd += ['-map', f'[out{i}]', '-map', '0:a?', *codec_args, '-c:a', 'aac',
+                '-f', 'segment', '-segment_time', str(chunk_duration), '-reset_timestamps', '1',
+                os.path.join(work_dir, f"{h}p_%03d.mp4")]
+    
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', result.stdout, result.stderr)
 
-def split_video(direct_url: str, chunk_duration: int, output_dir: str = "temp") -> str:
+def _copy_in_kernel(src_fd: int, dst_fd: int, size: int) -> int:
+    """
+    Copies `size` bytes from the start of src_fd to dst_fd's current offset
+    without a userspace buffer; usually a single syscall. Returns bytes copied.
+    copy_file_range (Linux 4.5+) is file-to-file and can share pages on tmpfs
+    or reflink on CoW filesystems; sendfile covers kernels/filesystems without it.
+    """
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src_fd, dst_fd, size - offset, offset)
+                if copied == 0:
+                    break
+                offset += copied
+            return offset
+        except OSError:
+            # EXDEV/ENOSYS/EINVAL: retry the remainder with sendfile
+            pass
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+    return offset
+
+def _add_stored(zipf: zipfile.ZipFile, path: str, arcname: str):
+    """
+    Adds `path` to a ZIP_STORED archive, moving the bytes in the kernel
+    (copy_file_range, else sendfile) instead of through Python buffers. The
+    CRC is computed up front over an mmap so the header can be written before
+    the data. Falls back to a buffered copy where neither works (macOS).
+    """
+    zinfo = zipfile.ZipInfo.from_file(path, arcname=arcname)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    size = zinfo.file_size
+    zipf._writecheck(zinfo)
+    
+    with open(path, 'rb') as src:
+        if size:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                zinfo.CRC = zlib.crc32(view)
+        else:
+            zinfo.CRC = 0
+        zinfo.compress_size = size
+        
+        zinfo.header_offset = zipf.fp.tell()
+        zipf.fp.write(zinfo.FileHeader(size > zipfile.ZIP64_LIMIT))
+        zipf.fp.flush()
+        data_start = zipf.fp.tell()
+        
+        try:
+            _copy_in_kernel(src.fileno(), zipf.fp.fileno(), size)
+        except OSError:
+            src.seek(0)
+            zipf.fp.seek(data_start)
+            shutil.copyfileobj(src, zipf.fp, 1 << 20)
+        
+        # The kernel copy moved the fd offset behind the buffered writer's back
+        zipf.fp.seek(data_start + size)
+    
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+def split_video(direct_url: str, chunk_duration: int, output_dir: str = TEMP_ROOT, precise: bool = False, duration: float = None, renditions: list = None) -> str:
     """
     Downloads and splits video into chunks of `chunk_duration`.
     Zips the resulting files.
     Returns path to the .zip file.
+    
+    By default streams are copied and cut on the nearest keyframes; pass
+    precise=True to re-encode for exact chunk boundaries. When the video's
+    `duration` is known, re-encoding runs one ffmpeg process per chunk in parallel.
+    `renditions` (a list of heights, e.g. [720, 480]) produces every chunk at
+    each of those resolutions from a single decode.
     """
-    unique_id = str(uuid.uuid4())
+    if chunk_duration <= 0:
+        raise ValueError("Chunk duration must be positive.")
+    
+    unique_id = _unique_name()
     work_dir = os.path.join(output_dir, unique_id)
     os.makedirs(work_dir, exist_ok=True)
     
@@ -90,24 +367,49 @@ def split_video(direct_url: str, chunk_duration: int, output_dir: str = "temp")
         # -c libx264: re-encode for precise cuts at exact times. Prompt asked for "High performance" but also "Exact how many segments". 
         # Re-encoding ensures duration accuracy but is slower.
         # "Precise cutting" usually implies re-encoding.
+        # So: copy unless the caller asked for precision, and re-encode if copying fails.
+        # The whole job (including a parallel split's processes) holds one slot
+        with FFMPEG_SLOTS:
+            done = False
+            if renditions:
+                _split_renditions(direct_url, chunk_duration, renditions, work_dir)
+                done = True
+            elif not precise:
+                try:
+                    (
+                        ffmpeg
+                        .input(direct_url)
+                        .output(segment_filename, f='segment', segment_time=chunk_duration, segment_time_delta=0.1, reset_timestamps=1, c='copy')
+                        .run(capture_stdout=True, capture_stderr=True)
+                    )
+                    done = True
+                except ffmpeg.Error as e:
+                    logger.warning(f"Stream-copy split failed, re-encoding: {e.stderr.decode('utf8') if e.stderr else str(e)}")
+                    for partial in glob.glob(os.path.join(work_dir, "*.mp4")):
+                        os.remove(partial)
         
-        (
-            ffmpeg
-            .input(direct_url)
-            .output(segment_filename, f='segment', segment_time=chunk_duration, reset_timestamps=1, vcodec='libx264', preset='fast', acodec='aac')
-            .run(capture_stdout=True, capture_stderr=True)
-        )
+            if not done and duration:
+                _split_parallel(direct_url, chunk_duration, duration, work_dir)
+            elif not done:
+                (
+                    ffmpeg
+                    .input(direct_url)
+                    .output(segment_filename, f='segment', segment_time=chunk_duration, reset_timestamps=1, acodec='aac', **video_encode_args('fast'), **_thread_args())
+                    .global_args(*_global_args())
+                    .run(capture_stdout=True, capture_stderr=True)
+                )
         
         # Create Zip
         zip_filename = f"segments_{unique_id}.zip"
         zip_path = os.path.join(output_dir, zip_filename)
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(work_dir):
-                for file in files:
-                    if file.endswith('.mp4'):
-                        file_path = os.path.join(root, file)
-                        zipf.write(file_path, arcname=file)
+        # MP4 is already compressed: DEFLATE would burn CPU for <1% savings, so store as-is
+        # Segments are written flat into work_dir; store them in name order
+        with os.scandir(work_dir) as it:
+            segments = sorted((entry for entry in it if entry.name.endswith('.mp4')), key=lambda entry: entry.name)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            for entry in segments:
+                _add_stored(zipf, entry.path, entry.name)
         
         logger.info(f"Created zip file: {zip_path}")
         
@@ -123,16 +425,192 @@ def split_video(direct_url: str, chunk_duration: int, output_dir: str = "temp")
         logger.error(f"FFmpeg split error: {e.stderr.decode('utf8') if e.stderr else str(e)}")
         raise RuntimeError(f"FFmpeg split failed: {e.stderr.decode('utf8') if e.stderr else str(e)}")
 
-def stream_video_segment(direct_url: str, start: int, end: int, audio_url: str = None, original_url: str = None, format_id: str = None):
+def _relay(src, dst, chunk_size: int = 1 << 20):
+    """
+    Copies src into dst (e.g. a yt-dlp response -> ffmpeg stdin), then closes dst.
+    """
+    try:
+        shutil.copyfileobj(src, dst, chunk_size)
+    except BrokenPipeError:
+        pass  # ffmpeg stops reading once it is past the end of the segment
+    except Exception as e:
+        # The source is closed under us once the stream is done; anything
+        # else is a failed download and the segment will come out truncated
+        if not getattr(src, 'closed', False):
+            logger.error(f"yt-dlp download failed mid-stream: {e}")
+    finally:
+        try:
+            dst.close()
+        except OSError:
+            pass
+
+# Bytes moved per read of ffmpeg's stdout
+STREAM_CHUNK = 1 << 20
+
+def _grow_pipe(pipe, size: int = STREAM_CHUNK):
+    """
+    Enlarges a pipe's kernel buffer (Linux only; default is 64KB) so each
+    read can move up to `size` bytes instead of many small reads.
+    """
+    F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', None) if fcntl else None
+    if F_SETPIPE_SZ is None:
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, size)
+    except OSError:
+        # Above /proc/sys/fs/pipe-max-size for unprivileged users; keep the default
+        pass
+
+def _stream_output(process, error_label: str = "FFmpeg streaming error"):
+    """
+    Yields an ffmpeg process's stdout in chunks until it exits.
+    read1() returns whatever is buffered (up to STREAM_CHUNK) without waiting
+    for a full chunk, so large reads don't delay the first bytes.
+    """
+    _grow_pipe(process.stdout)
+    try:
+        while True:
+            chunk = process.stdout.read1(STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+            
+        process.stdout.close()
+        process.wait()
+        
+        if process.returncode != 0:
+            error = process.stderr.read().decode('utf8')
+            logger.error(f"{error_label}: {error}")
+            
+    except Exception as e:
+        logger.error(f"Streaming exception: {e}")
+        process.kill()
+    finally:
+        # Client went away mid-stream: don't leave ffmpeg encoding for nobody
+        if process.poll() is None:
+            process.kill()
+
+# Browser-like headers for fetching CDN URLs directly
+HTTP_HEADERS = "User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36\r\nReferer: https://www.youtube.com/"
+
+def _direct_segment_process(direct_url: str, audio_url: str, start: float, duration: float, copy: bool = False, **input_opts):
+    """
+    Starts ffmpeg trimming [start, start+duration] straight from the CDN URL(s).
+    With copy=True the streams are remuxed as-is (start must be a keyframe).
+    Returns the running process with the fMP4 output on stdout.
+    """
+    if copy:
+        codec_opts = {'c': 'copy', 'movflags': 'frag_keyframe+empty_moov+default_base_moof'}
+    else:
+        codec_opts = {'acodec': 'aac', **video_encode_args('superfast', 23), **_thread_args(),
+                      'movflags': 'frag_keyframe+empty_moov'}
+    
+    stream = ffmpeg.input(direct_url, ss=start, t=duration, headers=HTTP_HEADERS, **input_opts)
+    
+    if audio_url:
+        audio_stream = ffmpeg.input(audio_url, ss=start, t=duration, headers=HTTP_HEADERS, **input_opts)
+        return (
+            ffmpeg
+            .output(stream, audio_stream, 'pipe:', 
+                   format='mp4', **codec_opts, shortest=None, loglevel="error")
+            .global_args(*_global_args())
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+    return (
+        ffmpeg
+        .output(stream, 'pipe:', 
+               format='mp4', **codec_opts, loglevel="error")
+        .global_args(*_global_args())
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+
+def _copy_start(direct_url: str, start: int, vcodec: str, acodec: str):
+    """
+    Returns the keyframe to stream-copy a segment from when the source is
+    already H.264/AAC (so it fits MP4 as-is) and `start` is within
+    KEYFRAME_TOLERANCE of a keyframe; otherwise None (re-encode).
+    """
+    if not (vcodec or '').startswith('avc1') or not (acodec or '').startswith('mp4a'):
+        return None
+    nearest = min(keyframes(direct_url, start), key=lambda kf: abs(kf - start), default=None)
+    if nearest is not None and abs(nearest - start) < KEYFRAME_TOLERANCE:
+        return nearest
+    return None
+
+def _stream_via_ytdlp(original_url: str, format_id: str, start: int, duration: int):
+    """
+    Streams a segment by relaying a download through yt-dlp into ffmpeg.
+    Slower than seeking in the CDN URL, but yt-dlp handles auth properly.
+    """
+    import subprocess
+    
+    # yt-dlp runs in-process and its responses are copied into ffmpeg's pipes,
+    # so encoding overlaps the download and nothing touches the disk.
+    # Merged formats (format_id+bestaudio) arrive as two streams: the video on
+    # stdin and the audio on an extra pipe, muxed by ffmpeg itself.
+    logger.info(f"Using yt-dlp->ffmpeg pipeline for YouTube URL")
+    
+    # Build format selector
+    format_str = 'best[ext=mp4]/best' if not format_id else f'{format_id}+bestaudio/best'
+    sources = open_format_streams(original_url, format_str)
+    
+    trim = ['-ss', str(start), '-t', str(duration)]
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', *_global_args(), *trim, '-i', 'pipe:0']
+    audio_read = audio_write = None
+    if len(sources) > 1:
+        audio_read, audio_write = os.pipe()
+        cmd += [*trim, '-i', f'pipe:{audio_read}', '-map', '0:v:0', '-map', '1:a:0']
+    cmd += [*_cli_args({**video_encode_args('superfast', 23), **_thread_args()}),
+            '-c:a', 'aac', '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov', 'pipe:1']
+    
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   pass_fds=(audio_read,) if audio_read is not None else ())
+    except OSError:
+        for source in sources:
+            source.close()
+        if audio_read is not None:
+            os.close(audio_read)
+            os.close(audio_write)
+        raise
+    
+    sinks = [process.stdin]
+    if audio_read is not None:
+        os.close(audio_read)  # ffmpeg has its own copy
+        sinks.append(os.fdopen(audio_write, 'wb'))
+    relays = [threading.Thread(target=_relay, args=(source, sink), daemon=True)
+              for source, sink in zip(sources, sinks)]
+    for relay in relays:
+        relay.start()
+    
+    try:
+        yield from _stream_output(process, "FFmpeg error")
+    finally:
+        # ffmpeg is done with the segment; the rest of the download isn't needed.
+        # Closing the responses unblocks relays still waiting on the network.
+        for source in sources:
+            try:
+                source.close()
+            except Exception:
+                pass
+        for relay in relays:
+            relay.join(timeout=5)
+
+def stream_video_segment(direct_url: str, start: int, end: int, audio_url: str = None, original_url: str = None, format_id: str = None, vcodec: str = None, acodec: str = None):
     """
     Generator that streams a specific video segment using ffmpeg.
     Yields chunks of bytes.
     
-    For YouTube URLs, uses yt-dlp subprocess to handle auth properly.
+    When `vcodec`/`acodec` say the source is already H.264/AAC and `start`
+    falls on a keyframe, the segment is remuxed without re-encoding.
+    
+    For YouTube URLs, ffmpeg seeks in the signed CDN URL with range requests,
+    falling back to a yt-dlp download pipe if the CDN refuses it.
     For other URLs (Facebook, etc), uses direct FFmpeg.
-    """
-    import subprocess
     
+    Raises FFmpegBusyError on the first next() if it has to encode and no
+    ffmpeg slot is free.
+    """
     duration = end - start
     if duration <= 0:
          raise ValueError("Invalid duration")
@@ -142,117 +620,182 @@ def stream_video_segment(direct_url: str, start: int, end: int, audio_url: str =
     # Check if this is a YouTube/googlevideo URL - they need special handling
     is_youtube = 'googlevideo.com' in direct_url or 'youtube.com' in direct_url
     
-    if is_youtube and original_url:
-        # Use yt-dlp to download to temp file, then ffmpeg to stream
-        logger.info(f"Using yt-dlp->ffmpeg pipeline for YouTube URL")
+    copy_from = _copy_start(direct_url, start, vcodec, acodec)
+    if copy_from is not None:
+        logger.info(f"Source is H.264/AAC, stream-copying from keyframe at {copy_from}s")
+        start, duration = copy_from, end - copy_from
+
+    # Only encodes take a slot (remuxing costs next to no CPU). It's held until
+    # the client finishes (or abandons) the stream; streams run at the client's
+    # pace, so they never queue for a slot: they fail instead.
+    slot = copy_from is None
+    if slot:
+        _take_slot()
+    try:
+        if is_youtube and original_url:
+            # ffmpeg's HTTP demuxer seeks with Range requests, so only the bytes
+            # around [start, end] are fetched instead of the whole video
+            process = _direct_segment_process(
+                direct_url, audio_url, start, duration, copy=copy_from is not None,
+                seekable=1, reconnect=1, reconnect_streamed=1, reconnect_delay_max=5
+            )
+            # Before the first read, so it gets the large pipe too
+            _grow_pipe(process.stdout)
+            first_chunk = process.stdout.read1(STREAM_CHUNK)
+            if first_chunk:
+                logger.info("Streaming YouTube segment via range requests")
+                yield first_chunk
+                yield from _stream_output(process)
+                return
+        
+            process.wait()
+            error = process.stderr.read().decode('utf8', 'replace')
+            logger.warning(f"Direct YouTube fetch failed, falling back to yt-dlp: {error}")
+            if not slot:
+                # The yt-dlp pipeline always re-encodes
+                _take_slot()
+                slot = True
+            yield from _stream_via_ytdlp(original_url, format_id, start, duration)
+        else:
+            # For non-YouTube URLs, use direct FFmpeg (Facebook, Instagram, etc work fine)
+            process = _direct_segment_process(direct_url, audio_url, start, duration, copy=copy_from is not None)
+            yield from _stream_output(process)
+    finally:
+        if slot:
+            FFMPEG_SLOTS.release()
+
+# Live HLS sessions are written here and served by main.py's /hls static mount
+HLS_ROOT = os.path.join(TEMP_ROOT, 'hls')
+os.makedirs(HLS_ROOT, exist_ok=True)
+
+HLS_SEGMENT_SECONDS = 2
+# A session's files are kept this long (or twice its duration, if longer)
+HLS_SESSION_TTL = 600
+
+_HLS_SESSIONS = {}  # session id -> {'process': Popen or None, 'expires': monotonic time}
+_HLS_LOCK = threading.Lock()
+
+def _remove_hls_session(session_id: str, session: dict):
+    """Kills a session's ffmpeg (if still running) and deletes its files."""
+    process = session['process']
+    if process is not None and process.poll() is None:
+        process.kill()
+    shutil.rmtree(os.path.join(HLS_ROOT, session_id), ignore_errors=True)
+
+def _reap_hls_sessions():
+    """Stops and deletes sessions past their expiry."""
+    now = time.monotonic()
+    with _HLS_LOCK:
+        expired = [sid for sid, session in _HLS_SESSIONS.items() if session['expires'] < now]
+        sessions = [(sid, _HLS_SESSIONS.pop(sid)) for sid in expired]
+    
+    for sid, session in sessions:
+        _remove_hls_session(sid, session)
+        logger.info(f"Removed expired HLS session {sid}")
+
+def stop_hls_session(session_id: str):
+    """Stops and deletes a session now, e.g. one nobody is going to play."""
+    with _HLS_LOCK:
+        session = _HLS_SESSIONS.pop(session_id, None)
+    if session is not None:
+        _remove_hls_session(session_id, session)
+        logger.info(f"Stopped HLS session {session_id}")
+
+# Sessions also expire while no new ones are started
+HLS_REAP_INTERVAL = 60
+
+def _reap_hls_periodically():
+    while True:
+        time.sleep(HLS_REAP_INTERVAL)
+        try:
+            _reap_hls_sessions()
+        except Exception as e:
+            logger.error(f"HLS session cleanup failed: {e}")
+
+threading.Thread(target=_reap_hls_periodically, name="hls-reaper", daemon=True).start()
+
+def start_hls_session(direct_url: str, start: int, end: int, audio_url: str = None) -> str:
+    """
+    Starts encoding [start, end] as an HLS event playlist with fMP4 segments
+    in HLS_ROOT/<session id>/ and returns the session id. The master playlist
+    is index.m3u8. Players can begin after the first segment and seek within
+    what has been written, instead of waiting on a single fMP4 response.
+    """
+    duration = end - start
+    if duration <= 0:
+        raise ValueError("Invalid duration")
+    
+    _reap_hls_sessions()
+    
+    # Like segment streams, sessions fail rather than queue for a slot
+    _take_slot()
+    # Served from a public mount, so the id must not be guessable
+    session_id = secrets.token_urlsafe(16)
+    session_dir = os.path.join(HLS_ROOT, session_id)
+    try:
+        os.makedirs(session_dir)
         
-        import tempfile
+        inputs = [ffmpeg.input(direct_url, ss=start, t=duration, headers=HTTP_HEADERS, **_http_input_opts(direct_url))]
+        if audio_url:
+            inputs.append(ffmpeg.input(audio_url, ss=start, t=duration, headers=HTTP_HEADERS, **_http_input_opts(audio_url)))
         
-        # Build format selector
-        format_str = 'best[ext=mp4]/best' if not format_id else f'{format_id}+bestaudio/best'
+        output = (
+            ffmpeg
+            .output(*inputs, os.path.join(session_dir, 'playlist.m3u8'),
+                    acodec='aac', **video_encode_args('superfast', 23), **_thread_args(),
+                    # A keyframe at every segment boundary keeps segments independently decodable
+                    force_key_frames=f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})',
+                    format='hls', hls_time=HLS_SEGMENT_SECONDS, hls_playlist_type='event',
+                    hls_segment_type='fmp4', hls_flags='independent_segments+program_date_time',
+                    master_pl_name='index.m3u8', loglevel='error')
+            .global_args(*_global_args())
+        )
         
-        # Create temp file for yt-dlp output
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_path = temp_file.name
-        temp_file.close()
+        session = {'process': None, 'expires': time.monotonic() + max(HLS_SESSION_TTL, 2 * duration)}
+        with _HLS_LOCK:
+            _HLS_SESSIONS[session_id] = session
         
-        try:
-            # Step 1: Download with yt-dlp to temp file
-            ytdlp_cmd = [
-                'yt-dlp',
-                '-f', format_str,
-                '--quiet',
-                '--no-warnings',
-                '-o', temp_path,
-                '--force-overwrites',
-                original_url
-            ]
-            
-            logger.info(f"Downloading with yt-dlp to {temp_path}...")
-            result = subprocess.run(ytdlp_cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                logger.error(f"yt-dlp error: {result.stderr}")
-                # Cleanup and fallback
-                os.unlink(temp_path)
-                return
-            
-            logger.info(f"Download complete, streaming with ffmpeg...")
-            
-            # Step 2: Stream from temp file with ffmpeg
-            stream = ffmpeg.input(temp_path, ss=start, t=duration)
-            process = (
-                ffmpeg
-                .output(stream, 'pipe:', 
-                       vcodec='libx264', preset='superfast', crf=23, 
-                       acodec='aac', format='mp4', 
-                       movflags='frag_keyframe+empty_moov', loglevel="error")
-                .run_async(pipe_stdout=True, pipe_stderr=True)
-            )
-            
+        def run():
+            # Owns the slot taken above
             try:
-                while True:
-                    chunk = process.stdout.read(65536)
-                    if not chunk:
-                        break
-                    yield chunk
-                    
-                process.stdout.close()
-                process.wait()
-                
-                if process.returncode != 0:
-                    error = process.stderr.read().decode('utf8')
-                    logger.error(f"FFmpeg error: {error}")
-                    
+                with _HLS_LOCK:
+                    if session_id not in _HLS_SESSIONS:
+                        return  # Stopped before ffmpeg started
+                    session['process'] = process = output.run_async(pipe_stderr=True)
+                _, error = process.communicate()
             except Exception as e:
-                logger.error(f"FFmpeg streaming exception: {e}")
-                process.kill()
-                
-        finally:
-            # Always cleanup temp file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-                logger.info(f"Cleaned up temp file: {temp_path}")
-    else:
-        # For non-YouTube URLs, use direct FFmpeg (Facebook, Instagram, etc work fine)
-        http_headers = "User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36\r\nReferer: https://www.youtube.com/"
-        
-        stream = ffmpeg.input(direct_url, ss=start, t=duration, headers=http_headers)
+                logger.error(f"FFmpeg HLS error ({session_id}): {e}")
+                return
+            finally:
+                FFMPEG_SLOTS.release()
+            if process.returncode not in (0, -9):
+                logger.error(f"FFmpeg HLS error ({session_id}): {error.decode('utf8', 'replace')}")
         
-        if audio_url:
-            audio_stream = ffmpeg.input(audio_url, ss=start, t=duration, headers=http_headers)
-            process = (
-                ffmpeg
-                .output(stream, audio_stream, 'pipe:', 
-                       vcodec='libx264', preset='superfast', crf=23, 
-                       acodec='aac', format='mp4', 
-                       movflags='frag_keyframe+empty_moov', shortest=None, loglevel="error")
-                .run_async(pipe_stdout=True, pipe_stderr=True)
-            )
-        else:
-            process = (
-                ffmpeg
-                .output(stream, 'pipe:', 
-                       vcodec='libx264', preset='superfast', crf=23, 
-                       acodec='aac', format='mp4', 
-                       movflags='frag_keyframe+empty_moov', loglevel="error")
-                .run_async(pipe_stdout=True, pipe_stderr=True)
-            )
+        threading.Thread(target=run, name=f"hls-{session_id}", daemon=True).start()
+    except Exception:
+        # The run thread releases the slot once started; until then it's ours
+        with _HLS_LOCK:
+            _HLS_SESSIONS.pop(session_id, None)
+        FFMPEG_SLOTS.release()
+        shutil.rmtree(session_dir, ignore_errors=True)
+        raise
+    logger.info(f"Started HLS session {session_id}: {start}-{end}s from {direct_url}")
+    return session_id
 
-        try:
-            while True:
-                chunk = process.stdout.read(65536)
-                if not chunk:
-                    break
-                yield chunk
-                
-            process.stdout.close()
-            process.wait()
-            
-            if process.returncode != 0:
-                error = process.stderr.read().decode('utf8')
-                logger.error(f"FFmpeg streaming error: {error}")
-                
-        except Exception as e:
-            logger.error(f"Streaming exception: {e}")
-            process.kill()
+def hls_playlist_ready(session_id: str) -> bool:
+    """
+    True once the session's first segment (and so its media playlist) exists.
+    Raises RuntimeError if the session's ffmpeg exited without producing one.
+    """
+    with _HLS_LOCK:
+        session = _HLS_SESSIONS.get(session_id)
+    if session is None:
+        raise RuntimeError("HLS session not found")
+    # Checked before the playlist so a run that finishes in between isn't reported as failed
+    finished = session['process'] is not None and session['process'].poll() is not None
+    
+    if os.path.exists(os.path.join(HLS_ROOT, session_id, 'playlist.m3u8')):
+        return True
+    if finished:
+        raise RuntimeError("FFmpeg HLS encoding failed")
+    return False
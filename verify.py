@@ -0,0 +1,420 @@
+import subprocess
+import socket
+import time
+import sys
+import os
+import functools
+import io
+import logging
+import logging.handlers
+import threading
+import zipfile
+import httpx
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+try:
+    import orjson
+
+    def dump_json(data):
+        return orjson.dumps(data)
+except ImportError:
+    import json
+
+    def dump_json(data):
+        return json.dumps(data, separators=(',', ':')).encode()
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+log = logging.getLogger("verify")
+
+def setup_logging(verbose=False):
+    """
+    Sends progress to stdout through one formatter. Records are buffered and
+    written in batches: at 100 records, on any error, and at logging.shutdown().
+    -v also shows per-response details (status codes, content types, sizes).
+    """
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(logging.handlers.MemoryHandler(100, flushLevel=logging.ERROR, target=stream))
+    log.setLevel(logging.DEBUG if verbose else logging.INFO)
+    # The app's own logging.basicConfig would print every record a second time
+    log.propagate = False
+
+# Bounds on every request, so a stuck server fails the run instead of hanging it
+ANALYZE_TIMEOUT = httpx.Timeout(10, connect=3.05)
+PROCESS_TIMEOUT = httpx.Timeout(60, connect=3.05)
+
+def post_json(client, path, body, timeout=PROCESS_TIMEOUT):
+    """POSTs `body` as JSON to `path` on the client's server and returns the response."""
+    return client.post(path, content=dump_json(body), headers=JSON_HEADERS, timeout=timeout)
+
+def stream_json(client, path, body, timeout=PROCESS_TIMEOUT):
+    """Like post_json, but as a context manager whose response body is read on demand."""
+    return client.stream("POST", path, content=dump_json(body), headers=JSON_HEADERS, timeout=timeout)
+
+# Short (15s) sample used by most checks
+SAMPLE_URL = "http://commondatastorage.googleapis.com/gtv-videos-bucket/sample/ForBiggerBlazes.mp4"
+
+def wait_for_server(host, port, total_timeout=float(os.getenv("VERIFY_TIMEOUT", 20)), max_delay=float(os.getenv("VERIFY_DELAY", 0.5))):
+    """
+    Waits for the port to accept connections, backing off from 10ms to max_delay.
+    A server that is already up is detected by the first probe, before any sleep.
+    """
+    deadline = time.monotonic() + total_timeout
+    delay = 0.01
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return True
+        except OSError:
+            if time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+# Big Buck Bunny is ~10 min (~150MB): long enough for > 1 segment, too big to fetch every run
+LONG_SAMPLE_URL = "http://commondatastorage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4"
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures")
+FIXTURE_PORT = 8765
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+# lru_cache doesn't serialize concurrent misses: without this, run()'s
+# prepare thread and test_analyze_long would both download into the same
+# .part file and both bind FIXTURE_PORT
+_LOCAL_SERVER_LOCK = threading.Lock()
+
+def setup_local_server():
+    """
+    Downloads the long sample into FIXTURES_DIR once (a .ok sentinel marks a
+    complete download) and serves FIXTURES_DIR on 127.0.0.1:FIXTURE_PORT.
+    Returns the sample's local URL. Runs once per process; concurrent
+    callers wait for the first one.
+    """
+    with _LOCAL_SERVER_LOCK:
+        return _setup_local_server()
+
+@functools.lru_cache(maxsize=None)
+def _setup_local_server():
+    name = os.path.basename(LONG_SAMPLE_URL)
+    path = os.path.join(FIXTURES_DIR, name)
+    sentinel = os.path.join(FIXTURES_DIR, ".ok")
+
+    if not (os.path.exists(sentinel) and os.path.exists(path)):
+        log.info(f"Caching {name} in {FIXTURES_DIR} (first run only)...")
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        with httpx.stream("GET", LONG_SAMPLE_URL, timeout=None) as response, open(path + ".part", "wb") as f:
+            response.raise_for_status()
+            for chunk in response.iter_bytes(1 << 20):
+                f.write(chunk)
+        os.replace(path + ".part", path)
+        open(sentinel, "w").close()
+
+    handler = functools.partial(QuietHandler, directory=FIXTURES_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", FIXTURE_PORT), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{FIXTURE_PORT}/{name}"
+
+def prepare_local_server():
+    """setup_local_server for a background thread; errors are left to test_analyze_long."""
+    try:
+        setup_local_server()
+    except Exception as e:
+        log.debug(f"Preparing the local sample failed, test_analyze_long will retry: {e}")
+
+def test_analyze_long(client):
+    log.info("\n--- Testing Analyze Endpoint ---")
+    api_url = "/analyze"
+
+    try:
+        data = {
+            # Using a longer video sample to ensure we get > 1 segment
+            "url": setup_local_server(),
+            "chunk_duration": 60
+        }
+        response = post_json(client, api_url, data, timeout=ANALYZE_TIMEOUT)
+        if response.status_code == 200:
+            body = response.json()
+            log.info(f"SUCCESS: {body}")
+            if body['total_duration'] > 0 and len(body['segments']) > 0:
+                return True
+            log.error("FAILURE: Expected a positive duration and at least one segment.")
+            return False
+        else:
+            log.error(f"HTTP Error: {response.status_code} - {response.text}")
+            return False
+    except Exception as e:
+        log.error(f"Error: {e}")
+        return False
+
+def test_process(client):
+    log.info("\n--- Testing Process (Split & Zip) Endpoint ---")
+    api_url = "/process"
+    data = {
+        # Using smaller sample for speed
+        "url": SAMPLE_URL,
+        "chunk_duration": 5
+    }
+
+    # Streamed into one buffer; the archive is small (a 15s sample in 5s parts)
+    with stream_json(client, api_url, data) as response:
+        log.debug(f"Response Code: {response.status_code}")
+        ctype = response.headers.get('Content-Type', '')
+        log.debug(f"Content-Type: {ctype}")
+
+        if response.status_code >= 400:
+            log.error(f"HTTP Error: {response.status_code} - {response.read().decode()}")
+            return False
+
+        if response.status_code != 200 or "application/zip" not in ctype:
+            log.error("FAILURE: Invalid response.")
+            return False
+
+        buf = bytearray()
+        for chunk in response.iter_bytes(1 << 16):
+            buf.extend(chunk)
+    log.debug(f"Received {len(buf)} bytes of ZIP data.")
+
+    # Verify zip header (local file header signature), then every entry's CRC
+    if not buf.startswith(b'PK\x03\x04'):
+        log.error("FAILURE: Content is not a valid zip.")
+        return False
+    try:
+        with zipfile.ZipFile(io.BytesIO(buf)) as archive:
+            names = archive.namelist()
+            bad = archive.testzip()
+    except zipfile.BadZipFile as e:
+        log.error(f"FAILURE: Corrupt zip: {e}")
+        return False
+    if bad is not None or not names:
+        log.error(f"FAILURE: Zip has {len(names)} entries, first bad entry: {bad}")
+        return False
+    log.info(f"SUCCESS: Valid ZIP with {len(names)} segments.")
+    return True
+
+def test_analyze_universal(client):
+    log.info("\n--- Testing Analyze Endpoint (Universal) ---")
+    api_url = "/analyze"
+    data = {
+        "url": SAMPLE_URL,
+        "chunk_duration": 5,
+        "platform": "fb"
+    }
+
+    try:
+        response = post_json(client, api_url, data, timeout=ANALYZE_TIMEOUT)
+        if response.status_code == 200:
+            body = response.json()
+            log.info(f"SUCCESS: {body}")
+            if 'segments' in body and len(body['segments']) > 0 and 'title' in body:
+                return True
+        else:
+            log.error(f"HTTP Error: {response.status_code} - {response.text}")
+            return False
+    except Exception as e:
+        log.error(f"Error: {e}")
+        return False
+
+# A stream's ffmpeg slot is freed once the server sees the previous
+# response close, so a 503 (all slots busy) is retried a few times
+BUSY_RETRIES = 3
+
+def check_segment(client, index, start, end):
+    """Requests one segment and checks that it streams an MP4."""
+    data = {
+        "url": SAMPLE_URL,
+        "start": start,
+        "end": end,
+        "segment_index": index
+    }
+
+    for attempt in range(BUSY_RETRIES + 1):
+        with stream_json(client, "/process-segment", data) as response:
+            if response.status_code != 503 or attempt == BUSY_RETRIES:
+                return check_segment_response(response, index)
+        log.debug(f"Segment {index}: server busy, retrying")
+        time.sleep(1)
+
+def check_segment_response(response, index):
+    """Checks that a /process-segment response streams an MP4."""
+    ctype = response.headers.get('Content-Type', '')
+    log.debug(f"Segment {index}: Response Code: {response.status_code}, Content-Type: {ctype}")
+
+    if response.status_code >= 400:
+        log.error(f"Segment {index}: HTTP Error: {response.status_code} - {response.read().decode()}")
+        return False
+
+    if response.status_code == 200 and "video/mp4" in ctype:
+        # The first box of an MP4 is ftyp: bytes 4-8 of the stream.
+        # (Segments are transcoded live and can't honour Range, so just stop reading.)
+        head = next(response.iter_bytes(8), b'')
+        if head[4:8] == b'ftyp':
+            log.info(f"Segment {index}: SUCCESS: Received initial bytes of MP4 stream.")
+            return True
+        elif head:
+            log.error(f"Segment {index}: FAILURE: Stream does not start with an MP4 ftyp box.")
+            return False
+        else:
+            log.error(f"Segment {index}: FAILURE: Empty stream.")
+            return False
+    else:
+        log.error(f"Segment {index}: FAILURE: Invalid response content-type or status.")
+        return False
+
+# The 15s sample as three 5s segments
+SEGMENTS = [(1, 0, 5), (2, 5, 10), (3, 10, 15)]
+# Each open segment stream holds one of the server's ffmpeg slots
+MAX_CONCURRENT_SEGMENTS = int(os.environ.get("MAX_CONCURRENT_FFMPEG", 4))
+
+def test_process_segment(client):
+    log.info("\n--- Testing Process Segment (Streaming) Endpoint ---")
+    # Segments are requested concurrently (up to the server's slot count) over the shared keep-alive client
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SEGMENTS) as pool:
+        futures = [pool.submit(check_segment, client, *segment) for segment in SEGMENTS]
+        for future in as_completed(futures):
+            if not future.result():
+                # Stop at the first failure: drop the segments not started yet
+                for pending in futures:
+                    pending.cancel()
+                return False
+    return True
+
+# Suite name -> endpoint tests; each takes the shared client
+SUITES = {
+    "splitter": [test_analyze_long, test_process],
+    "universal": [test_analyze_universal, test_process_segment],
+}
+
+def run_case(test, client):
+    try:
+        return test(client)
+    except httpx.TimeoutException as e:
+        log.error(f"FAILURE: {test.__name__} timed out ({type(e).__name__}).")
+        return False
+
+def run_suite(name, client):
+    log.info(f"\n=== Suite: {name} ===")
+    tests = SUITES[name]
+    # The endpoints are independent, so a suite's tests run at once
+    with ThreadPoolExecutor(max_workers=len(tests)) as pool:
+        results = [future.result() for future in [pool.submit(run_case, test, client) for test in tests]]
+    return all(results)
+
+def run_suites(names, client):
+    for name in names:
+        if not run_suite(name, client):
+            log.error(f"\nSUITE {name} FAILED.")
+            return False
+
+    log.info("\nALL TESTS PASSED.")
+    return True
+
+# Persistent bytecode cache for the server subprocess (cache it in CI between runs)
+PYCACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pycache")
+
+def server_env():
+    """
+    Environment for the uvicorn subprocess: bytecode goes to PYCACHE_DIR, so
+    later runs import FastAPI and the app from .pyc instead of compiling.
+    """
+    env = {**os.environ, "PYTHONPYCACHEPREFIX": PYCACHE_DIR}
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+SERVER_LOG = "uvicorn.log"
+
+def prewarm(host, port, attempts=10):
+    """
+    Connects to the server once it listens, in the background, so the first
+    accept happens while the caller is still setting up rather than on the
+    first probe or test request.
+    """
+    for _ in range(attempts):
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+def start_server():
+    """
+    Starts uvicorn on 127.0.0.1:8000. Its output goes to SERVER_LOG when
+    VERIFY_VERBOSE=1 and is discarded otherwise: pipes nobody reads fill up
+    (64KB) and then block the server's logging.
+    """
+    verbose = os.getenv("VERIFY_VERBOSE") == "1"
+    output = open(SERVER_LOG, "wb") if verbose else subprocess.DEVNULL
+    try:
+        process = subprocess.Popen(
+            ["venv/bin/uvicorn", "main:app", "--host", "127.0.0.1", "--port", "8000"],
+            stdout=output,
+            stderr=subprocess.STDOUT,
+            env=server_env()
+        )
+    finally:
+        # The child has its own copy of the descriptor
+        if verbose:
+            output.close()
+    threading.Thread(target=prewarm, args=("127.0.0.1", 8000), daemon=True).start()
+    return process
+
+def run(names, external=False):
+    """
+    Runs the named suites against main:app in-process through TestClient (no
+    server start-up), or with external=True over TCP against the server on
+    127.0.0.1:8000, starting uvicorn there if nothing is listening yet.
+    """
+    if "splitter" in names:
+        # Fetched/served up front (while uvicorn boots, when external)
+        prepare = threading.Thread(target=prepare_local_server, daemon=True)
+        prepare.start()
+
+    if not external:
+        from fastapi.testclient import TestClient
+        from main import app
+
+        with TestClient(app) as client:
+            return run_suites(names, client)
+
+    server_process = None
+    if not wait_for_server("127.0.0.1", 8000, total_timeout=0):
+        server_process = start_server()
+    # One keep-alive client for every probe and test call
+    client = httpx.Client(base_url="http://127.0.0.1:8000", limits=httpx.Limits(max_keepalive_connections=4, max_connections=10), timeout=None)
+
+    try:
+        if not wait_for_server("127.0.0.1", 8000):
+            log.error("Server failed to start.")
+            return False
+
+        return run_suites(names, client)
+
+    finally:
+        client.close()
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+def main(argv):
+    """
+    Usage: verify.py [--external] [-v] [suite ...]   (default: every suite in SUITES)
+    --external tests through a real uvicorn server and the network stack.
+    -v logs per-response details.
+    """
+    external = "--external" in argv
+    setup_logging(verbose="-v" in argv)
+    names = [arg for arg in argv if arg not in ("--external", "-v")] or list(SUITES)
+    unknown = [name for name in names if name not in SUITES]
+    try:
+        if unknown:
+            log.error(f"Unknown suite(s): {', '.join(unknown)}. Available: {', '.join(SUITES)}")
+            return 2
+        return 0 if run(names, external) else 1
+    finally:
+        logging.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))